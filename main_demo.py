@@ -1,8 +1,13 @@
 """main_demo.py — Point d'entrée démo et vérifications rapides."""
 import json
-from src.models import SensorReading, IngestRequest, ValidationError
+from src.models import (
+    SensorReading, IngestRequest, IngestResponse, ValidationError
+)
 from src.validators import validate_single_reading
-from src.protocol import encode_message, decode_message, build_message
+from src.protocol import (
+    PROTOCOL_VERSION, encode_message, decode_message, build_message,
+    encode_ingest_response,
+)
 
 def run_checks():
     """Exécute des vérifications simples."""
@@ -11,7 +16,7 @@ def run_checks():
     # Check 1 : encode / decode
     msg = build_message("ping", {"status": "alive"})
     encoded = encode_message(msg)
-    decoded = decode_message(encoded.decode("utf-8"))
+    decoded = decode_message(encoded)
     assert decoded["type"] == "ping", "Échec encode/decode"
     assert decoded["payload"]["status"] == "alive"
     print("✅ Check 1 : encode/decode OK")
@@ -52,12 +57,35 @@ def run_checks():
     # Check 6 : message protocolaire complet
     ingest_req = IngestRequest(source="test", readings=[valid_reading])
     proto_msg = build_message("ingest_request", ingest_req.to_dict())
-    assert proto_msg["version"] == "v1"
+    assert proto_msg["version"] == PROTOCOL_VERSION
     assert proto_msg["type"] == "ingest_request"
     assert "request_id" in proto_msg
     assert "sent_at" in proto_msg
     print("✅ Check 6 : structure protocolaire OK")
 
+    # Check 7 : forme compacte sur le fil (type codé, None omis)
+    wire = valid_reading.to_dict()
+    assert isinstance(wire["type"], int)
+    assert "pump_status" not in wire and "irrigation_mm" not in wire
+    assert SensorReading.from_dict(wire) == valid_reading
+    print("✅ Check 7 : forme compacte aller-retour OK")
+
+    # Check 8 : réponse encodée par gabarit = réponse construite en dict
+    errors = [ValidationError("t02", "value", "hors plage")]
+    error_dicts = [e.to_dict() for e in errors]
+    for rid in ("abc", "", None):
+        templ = decode_message(
+            encode_ingest_response(rid, 1, 1, error_dicts, 0.5))
+        ref = decode_message(encode_message(build_message(
+            "ingest_response",
+            IngestResponse(rid, 1, 1, errors, 0.5).to_dict(),
+            request_id=rid)))
+        # request_id d'enveloppe et sent_at peuvent légitimement différer
+        assert bool(templ.pop("request_id")) and bool(ref.pop("request_id"))
+        del templ["sent_at"], ref["sent_at"]
+        assert templ == ref, f"Gabarit divergent pour request_id={rid!r}"
+    print("✅ Check 8 : gabarit ingest_response conforme OK")
+
     print("\n=== Toutes les vérifications passées ! ===")
 
 
@@ -0,0 +1,7 @@
+"""Service d'ingestion IoT sur sockets TCP.
+
+Convention : sur les chemins chauds, les paramètres préfixés par '_'
+(ex. _check, _now) lient à la définition les fonctions appelées, pour un
+accès local plutôt que global. Ils font partie de l'implémentation :
+les appelants ne les passent jamais.
+"""
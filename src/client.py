@@ -7,7 +7,12 @@ import time
 
 from src.models import IngestRequest, SensorReading
 from src.protocol import (
-    encode_message, recv_line, decode_message, build_message
+    PROTOCOL_VERSION, recv_line, decode_message, build_message,
+    encode_message, new_request_id, set_socket_buffers, tune_socket,
+)
+from src.protocol_binary import (
+    BINARY_AVAILABLE, decode_message_msgpack, encode_message_msgpack,
+    recv_frame,
 )
 
 logging.basicConfig(
@@ -24,31 +29,48 @@ def load_readings(filepath: str) -> list[dict]:
         return json.load(f)
 
 
-def send_ingest_request(host: str, port: int, request_msg: dict,
-                        timeout: float = 10.0) -> dict | None:
-    """Envoie un message et retourne la réponse parsée."""
-    request_id = request_msg.get("request_id", "?")
+def send_ingest_request(host: str, port: int, request_id: str,
+                        request_bytes: bytes, timeout: float = 10.0,
+                        binary: bool = False) -> dict | None:
+    """
+    Envoie une requête déjà encodée et retourne la réponse parsée.
+    binary : la réponse attendue est une trame MessagePack.
+    """
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             sock.settimeout(timeout)
+            # Buffers réglés avant connect() pour la négociation de fenêtre
+            set_socket_buffers(sock)
+            tune_socket(sock)
             logger.info("[%s] Connexion à %s:%d …", request_id, host, port)
             sock.connect((host, port))
 
-            payload_bytes = encode_message(request_msg)
-            sock.sendall(payload_bytes)
+            sock.sendall(request_bytes)
             logger.info("[%s] Requête envoyée (%d octets)",
-                        request_id, len(payload_bytes))
+                        request_id, len(request_bytes))
 
             # Lire la réponse
-            buffer = bytearray()
-            line = recv_line(sock, buffer)
-            if line is None:
+            if binary:
+                raw = recv_frame(sock)
+            else:
+                raw = recv_line(sock, bytearray())
+            if raw is None:
                 logger.error("[%s] Pas de réponse du serveur", request_id)
                 return None
 
-            response = decode_message(line)
+            if binary:
+                response = decode_message_msgpack(raw)
+            else:
+                response = decode_message(raw)
             logger.info("[%s] Réponse reçue : type=%s",
                         request_id, response.get("type"))
+            if response.get("version") != PROTOCOL_VERSION:
+                # Un serveur plus ancien ne comprend pas les types codés
+                # et aurait accepté les lectures sans contrôle de plage.
+                logger.error("[%s] Serveur en protocole %s, %s attendu : "
+                             "résultat ignoré", request_id,
+                             response.get("version"), PROTOCOL_VERSION)
+                return None
             return response
 
     except socket.timeout:
@@ -59,6 +81,8 @@ def send_ingest_request(host: str, port: int, request_msg: dict,
         logger.error("[%s] 💥 Connexion réinitialisée", request_id)
     except OSError as e:
         logger.error("[%s] Erreur réseau : %s", request_id, e)
+    except ValueError as e:
+        logger.error("[%s] Réponse invalide : %s", request_id, e)
     return None
 
 
@@ -87,7 +111,11 @@ def main():
     parser.add_argument("--host", default="127.0.0.1")
     parser.add_argument("--port", type=int, default=9000)
     parser.add_argument("--data", default="data/sample_readings.json")
+    parser.add_argument("--binary", action="store_true",
+                        help="trames MessagePack au lieu de NDJSON")
     args = parser.parse_args()
+    if args.binary and not BINARY_AVAILABLE:
+        parser.error("--binary nécessite le paquet msgpack")
 
     # Charger les données
     raw_readings = load_readings(args.data)
@@ -95,14 +123,18 @@ def main():
     ingest_req = IngestRequest(source="station_agri_01", readings=readings)
 
     # Construire le message protocolaire
-    msg = build_message("ingest_request", ingest_req.to_dict())
-    request_id = msg["request_id"]
+    request_id = new_request_id()
+    msg = build_message("ingest_request", ingest_req.to_dict(),
+                        request_id=request_id)
+    encode = encode_message_msgpack if args.binary else encode_message
+    request_bytes = encode(msg)
     logger.info("[%s] %d lectures chargées depuis %s",
                 request_id, len(readings), args.data)
 
     # Envoyer et recevoir
     start = time.time()
-    response = send_ingest_request(args.host, args.port, msg)
+    response = send_ingest_request(args.host, args.port, request_id,
+                                   request_bytes, binary=args.binary)
     elapsed = (time.time() - start) * 1000
 
     if response:
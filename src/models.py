@@ -2,7 +2,23 @@
 from dataclasses import dataclass, field
 from typing import List, Optional
 
-@dataclass
+# Types de capteurs connus : sur le fil, chacun est transmis par son index.
+# Ajouts en fin de tuple uniquement : réordonner ou retirer un type
+# changerait silencieusement les codes compris par les clients déjà
+# déployés. validators.VALUE_RANGES est construit à partir de ce tuple.
+SENSOR_TYPES = ("temperature", "humidity", "rainfall", "irrigation",
+                "wind_speed")
+TYPE_CODES = {name: code for code, name in enumerate(SENSOR_TYPES)}
+
+
+def decode_sensor_type(raw: object) -> object:
+    """Retourne le nom du type pour un code entier connu, raw sinon."""
+    if type(raw) is int and 0 <= raw < len(SENSOR_TYPES):
+        return SENSOR_TYPES[raw]
+    return raw
+
+
+@dataclass(slots=True)
 class SensorReading:
     """Une mesure individuelle d'un capteur IoT."""
     sensor_id: str
@@ -14,21 +30,25 @@ class SensorReading:
     irrigation_mm: Optional[float] = None
 
     def to_dict(self) -> dict:
-        return {
+        """Forme compacte : type codé, champs optionnels omis si None."""
+        d = {
             "sensor_id": self.sensor_id,
-            "type": self.type,
+            "type": TYPE_CODES.get(self.type, self.type),
             "value": self.value,
             "unit": self.unit,
             "timestamp": self.timestamp,
-            "pump_status": self.pump_status,
-            "irrigation_mm": self.irrigation_mm,
         }
+        if self.pump_status is not None:
+            d["pump_status"] = self.pump_status
+        if self.irrigation_mm is not None:
+            d["irrigation_mm"] = self.irrigation_mm
+        return d
 
     @classmethod
     def from_dict(cls, d: dict) -> "SensorReading":
         return cls(
             sensor_id=d.get("sensor_id", ""),
-            type=d.get("type", ""),
+            type=decode_sensor_type(d.get("type", "")),
             value=d.get("value"),
             unit=d.get("unit", ""),
             timestamp=d.get("timestamp", ""),
@@ -37,7 +57,7 @@ class SensorReading:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class ValidationError:
     """Décrit une erreur de validation sur une lecture."""
     sensor_id: str
@@ -54,7 +74,7 @@ class ValidationError:
                    message=d["message"])
 
 
-@dataclass
+@dataclass(slots=True)
 class IngestRequest:
     """Requête d'ingestion contenant plusieurs lectures."""
     source: str
@@ -72,7 +92,7 @@ class IngestRequest:
         return cls(source=d.get("source", ""), readings=readings)
 
 
-@dataclass
+@dataclass(slots=True)
 class IngestResponse:
     """Réponse du serveur après traitement d'une requête d'ingestion."""
     request_id: str
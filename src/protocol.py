@@ -1,70 +1,186 @@
 """protocol.py — Encodage, décodage et framing des messages NDJSON."""
 import json
+import secrets
 import socket
-import uuid
+import time
 from datetime import datetime
+from typing import Iterator
 
-PROTOCOL_VERSION = "v1"
+try:
+    import orjson
+except ImportError:  # pragma: no cover — repli sur la bibliothèque standard
+    orjson = None
+
+# v2 : lectures compactes (type en code entier, champs None omis)
+PROTOCOL_VERSION = "v2"
+SUPPORTED_VERSIONS = ("v1", "v2")
 MAX_MESSAGE_SIZE = 1_048_576  # 1 Mo
+RECV_CHUNK_SIZE = 65_536      # octets lus par appel recv()
+SENT_AT_RESOLUTION = 1.0      # secondes entre deux reformatages de sent_at
+SOCKET_BUFFER_SIZE = 1 << 20  # SO_RCVBUF / SO_SNDBUF : un message max
+
+# [instant time.time(), sent_at ISO correspondant]
+_TS_CACHE = [0.0, ""]
+
+
+def _sent_at(_time=time.time) -> str:
+    """Horodatage ISO de sent_at, reformaté au plus une fois par seconde."""
+    now = _time()
+    # Aussi rafraîchi si l'horloge a reculé (NTP, réglage manuel)
+    if not 0 <= now - _TS_CACHE[0] <= SENT_AT_RESOLUTION:
+        _TS_CACHE[:] = [now, datetime.fromtimestamp(now).isoformat()]
+    return _TS_CACHE[1]
+
+
+def new_request_id() -> str:
+    """Génère un identifiant de requête aléatoire (32 caractères hex)."""
+    return secrets.token_hex(16)
 
 
 def build_message(msg_type: str, payload: dict,
-                  request_id: str | None = None) -> dict:
-    """Construit un message conforme au protocole v1."""
+                  request_id: str | None = None,
+                  _new_id=new_request_id, _now=_sent_at) -> dict:
+    """Construit un message conforme au protocole courant."""
     return {
         "version": PROTOCOL_VERSION,
         "type": msg_type,
-        "request_id": request_id or str(uuid.uuid4()),
-        "sent_at": datetime.now().isoformat(),
+        "request_id": request_id or _new_id(),
+        "sent_at": _now(),
         "payload": payload,
     }
 
 
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False,
+                          separators=(",", ":")).encode("utf-8")
+
+    _loads = json.loads
+
+
 def encode_message(msg: dict) -> bytes:
     """Sérialise un dict en JSON compact + newline → bytes UTF-8."""
-    line = json.dumps(msg, ensure_ascii=False, separators=(",", ":"))
-    return (line + "\n").encode("utf-8")
+    return _dumps(msg) + b"\n"
+
+
+# Enveloppe ingest_response à forme fixe : seuls les champs variables sont
+# sérialisés, le reste est recopié tel quel.
+_INGEST_RESPONSE_TEMPLATE = (
+    b'{"version":"' + PROTOCOL_VERSION.encode("ascii") + b'",'
+    b'"type":"ingest_response","request_id":%s,"sent_at":"%s",'
+    b'"payload":{"request_id":%s,"accepted_count":%d,"rejected_count":%d,'
+    b'"errors":%s,"processing_time_ms":%.2f}}\n'
+)
+
+
+def encode_ingest_response(request_id: str, accepted_count: int,
+                           rejected_count: int, errors: list,
+                           processing_time_ms: float,
+                           _new_id=new_request_id) -> bytes:
+    """
+    Encode directement une réponse ingest_response en ligne NDJSON.
+    Équivalent à encode_message(build_message("ingest_response", ...))
+    avec le payload d'IngestResponse.to_dict(), sans dict intermédiaire.
+    """
+    # Comme build_message : enveloppe sans identifiant → nouvel identifiant,
+    # le payload garde celui de la requête tel quel.
+    return _INGEST_RESPONSE_TEMPLATE % (
+        _dumps(request_id or _new_id()), _sent_at().encode("ascii"),
+        _dumps(request_id),
+        accepted_count, rejected_count, _dumps(errors), processing_time_ms)
 
 
-def decode_message(raw: str) -> dict:
-    """Parse une ligne JSON en dict Python."""
-    stripped = raw.strip()
-    if not stripped:
+def decode_message(raw: bytes) -> dict:
+    """Parse une ligne JSON (bytes UTF-8) en dict Python."""
+    if not raw or raw.isspace():
         raise ValueError("Message vide")
-    return json.loads(stripped)
+    msg = _loads(raw)
+    if not isinstance(msg, dict):
+        raise ValueError(
+            f"Message invalide : objet attendu, reçu {type(msg).__name__}")
+    return msg
+
+
+def set_socket_buffers(sock: socket.socket) -> None:
+    """
+    Agrandit les buffers noyau pour un message de taille maximale.
+    À appeler avant connect()/listen() : la fenêtre TCP est négociée
+    pendant la poignée de main.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+
+
+def tune_socket(sock: socket.socket) -> None:
+    """Désactive Nagle pour les échanges requête/réponse courts."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def recv_lines(conn: socket.socket, buffer: bytearray,
+               max_size: int = MAX_MESSAGE_SIZE) -> Iterator[bytes]:
+    """
+    Lit le socket et accumule dans buffer.
+    Produit chaque ligne complète (bytes, sans le '\\n') dès qu'elle est
+    disponible : toutes les lignes reçues par un même recv() sont livrées
+    avant l'appel système suivant. S'arrête à la fermeture de la connexion.
+    """
+    # Zone de réception réutilisée : recv_into() y écrit directement,
+    # sans allouer un nouvel objet bytes à chaque appel système.
+    chunk = bytearray(RECV_CHUNK_SIZE)
+    view = memoryview(chunk)
+    scan_start = 0
+
+    try:
+        while True:
+            # Livrer toutes les lignes complètes déjà présentes
+            newline_pos = buffer.find(b"\n", scan_start)
+            while newline_pos != -1:
+                if newline_pos > max_size:
+                    raise ValueError(
+                        f"Message trop volumineux (> {max_size} octets)")
+                line = bytes(buffer[:newline_pos])
+                del buffer[:newline_pos + 1]
+                yield line
+                newline_pos = buffer.find(b"\n")
+            # Le reste du buffer ne contient pas de '\n' : inutile de le
+            # re-parcourir après la prochaine lecture.
+            scan_start = len(buffer)
+
+            # Pas de ligne complète → lire plus de données
+            nbytes = conn.recv_into(chunk)
+            if not nbytes:
+                # Connexion fermée
+                if buffer:
+                    # Retourner ce qui reste comme dernière ligne
+                    line = bytes(buffer)
+                    buffer.clear()
+                    yield line
+                return
+
+            buffer += view[:nbytes]
+
+            # Ligne encore incomplète déjà trop longue (les lignes complètes
+            # sont contrôlées une à une avant d'être livrées)
+            if (len(buffer) > max_size
+                    and buffer.find(b"\n", scan_start) == -1):
+                raise ValueError(
+                    f"Message trop volumineux (> {max_size} octets)")
+    finally:
+        view.release()
 
 
 def recv_line(conn: socket.socket, buffer: bytearray,
-              max_size: int = MAX_MESSAGE_SIZE) -> str | None:
+              max_size: int = MAX_MESSAGE_SIZE) -> bytes | None:
     """
     Lit le socket et accumule dans buffer.
-    Retourne la première ligne complète (str) ou None si connexion fermée.
+    Retourne la première ligne complète (bytes, sans le '\\n') ou None
+    si connexion fermée.
     """
-    while True:
-        # Chercher un '\n' dans le buffer existant
-        newline_pos = buffer.find(b"\n")
-        if newline_pos != -1:
-            line = buffer[:newline_pos].decode("utf-8")
-            del buffer[:newline_pos + 1]
-            return line
-
-        # Pas de ligne complète → lire plus de données
-        try:
-            chunk = conn.recv(4096)
-        except socket.timeout:
-            raise
-        if not chunk:
-            # Connexion fermée
-            if buffer:
-                # Retourner ce qui reste comme dernière ligne
-                line = buffer[:].decode("utf-8")
-                buffer.clear()
-                return line
-            return None
-
-        buffer.extend(chunk)
-
-        # Protection contre les messages trop volumineux
-        if len(buffer) > max_size:
-            raise ValueError(
-                f"Message trop volumineux (> {max_size} octets)")
\ No newline at end of file
+    lines = recv_lines(conn, buffer, max_size)
+    try:
+        return next(lines, None)
+    finally:
+        lines.close()
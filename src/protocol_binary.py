@@ -0,0 +1,81 @@
+"""protocol_binary.py — Trames binaires MessagePack préfixées par leur longueur.
+
+Chaque trame est une longueur sur 4 octets (big-endian) suivie du message
+sérialisé en MessagePack. Comme MAX_MESSAGE_SIZE reste sous 16 Mo, le
+premier octet d'une trame est toujours nul, alors qu'une ligne NDJSON
+commence par '{' : le serveur choisit le format d'une connexion d'après
+son premier octet.
+"""
+import socket
+import struct
+
+from src.protocol import MAX_MESSAGE_SIZE
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover — dépendance optionnelle
+    msgpack = None
+
+BINARY_AVAILABLE = msgpack is not None
+BINARY_MARKER = b"\x00"   # premier octet d'une connexion binaire
+FRAME_HEADER = struct.Struct(">I")
+
+
+def encode_message_msgpack(msg: dict) -> bytes:
+    """Sérialise un dict en trame MessagePack préfixée par sa longueur."""
+    body = msgpack.packb(msg, use_bin_type=True)
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def decode_message_msgpack(body: bytes) -> dict:
+    """Parse le corps d'une trame MessagePack en dict Python."""
+    if not body:
+        raise ValueError("Message vide")
+    try:
+        msg = msgpack.unpackb(body, raw=False)
+    except ValueError as e:
+        # Certaines erreurs de msgpack (FormatError) n'ont pas de message
+        detail = str(e)
+        raise ValueError(f"Trame MessagePack invalide : {detail}" if detail
+                         else "Trame MessagePack invalide") from None
+    if not isinstance(msg, dict):
+        raise ValueError(
+            f"Message invalide : map attendue, reçu {type(msg).__name__}")
+    return msg
+
+
+def _recv_exactly(conn: socket.socket, size: int) -> bytearray | None:
+    """
+    Lit exactement size octets via recv_into().
+    Retourne None si la connexion est fermée avant le premier octet.
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        nbytes = conn.recv_into(view[received:])
+        if not nbytes:
+            if received:
+                raise ValueError(
+                    f"Trame tronquée ({received}/{size} octets)")
+            return None
+        received += nbytes
+    return buf
+
+
+def recv_frame(conn: socket.socket,
+               max_size: int = MAX_MESSAGE_SIZE) -> bytearray | None:
+    """
+    Lit une trame complète sur le socket.
+    Retourne son corps (sans l'en-tête) ou None si connexion fermée.
+    """
+    header = _recv_exactly(conn, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > max_size:
+        raise ValueError(f"Message trop volumineux (> {max_size} octets)")
+    body = _recv_exactly(conn, size)
+    if body is None:
+        raise ValueError(f"Trame tronquée (0/{size} octets)")
+    return body
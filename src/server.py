@@ -1,13 +1,21 @@
 """server.py — Serveur TCP d'ingestion IoT."""
+import asyncio
 import socket
 import logging
 import argparse
+import multiprocessing
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from src.models import IngestRequest, IngestResponse, SensorReading
-from src.validators import validate_readings
+from src.models import decode_sensor_type
+from src.validators import check_reading_fields
+from src.protocol_binary import (
+    BINARY_AVAILABLE, BINARY_MARKER, FRAME_HEADER, decode_message_msgpack,
+    encode_message_msgpack,
+)
 from src.protocol import (
-    recv_line, decode_message, encode_message, build_message
+    MAX_MESSAGE_SIZE, SUPPORTED_VERSIONS, decode_message, encode_message,
+    build_message, encode_ingest_response, set_socket_buffers, tune_socket,
 )
 
 logging.basicConfig(
@@ -17,105 +25,301 @@ logging.basicConfig(
 )
 logger = logging.getLogger("ingestion.server")
 
+CLIENT_TIMEOUT = 30.0  # secondes d'inactivité tolérées par connexion
+WORKER_THREADS = 32    # threads de traitement des messages par processus
+LISTEN_BACKLOG = 100   # connexions en attente d'accept()
+
+
+def process_ingest_payload(payload: dict, request_id: str,
+                           start_time: float, compact: bool = True,
+                           _check=check_reading_fields,
+                           _decode_type=decode_sensor_type,
+                           _time=time.time) -> dict:
+    """
+    Valide les lectures d'un payload ingest_request en une seule passe,
+    sans construire de SensorReading, et retourne le payload de réponse
+    (même forme que IngestResponse.to_dict()). compact : les types sont
+    des codes entiers (v2) à décoder.
+    """
+    accepted_count = 0
+    errors = []
+
+    for r in payload.get("readings", []):
+        sensor_type = r.get("type", "")
+        if compact:
+            sensor_type = _decode_type(sensor_type)
+        problems = _check(
+            r.get("sensor_id", ""), sensor_type, r.get("value"),
+            r.get("timestamp", ""), r.get("pump_status"),
+            r.get("irrigation_mm"))
+        if not problems:
+            accepted_count += 1
+            continue
+        sid = r.get("sensor_id", "") or "(vide)"
+        for name, message in problems:
+            errors.append({"sensor_id": sid, "field": name,
+                           "message": message})
+
+    elapsed_ms = (_time() - start_time) * 1000
+    return {
+        "request_id": request_id,
+        "accepted_count": accepted_count,
+        "rejected_count": len(errors),
+        "errors": errors,
+        "processing_time_ms": round(elapsed_ms, 2),
+    }
+
 
-def handle_client(conn: socket.socket, addr: tuple):
-    """Traite une connexion client unique."""
-    buffer = bytearray()
+def process_message(
+    raw: bytes, addr: tuple, binary: bool = False,
+) -> tuple[str, bytes, tuple | None]:
+    """
+    Décode un message (ligne NDJSON ou corps de trame MessagePack si
+    binary), le traite et construit la réponse dans le même format.
+    Retourne (request_id, réponse encodée, bilan) ; bilan vaut
+    (source, acceptées, rejetées, temps ms) pour une ingestion, None pour
+    une réponse d'erreur (déjà journalisée).
+    """
     request_id = "unknown"
     start_time = time.time()
+    if binary:
+        decode, encode = decode_message_msgpack, encode_message_msgpack
+    else:
+        decode, encode = decode_message, encode_message
 
     try:
-        conn.settimeout(30.0)
-
-        # Lire un message NDJSON
-        line = recv_line(conn, buffer)
-        if line is None:
-            logger.warning("Connexion fermée immédiatement par %s", addr)
-            return
-
         # Décoder le message protocolaire
-        msg = decode_message(line)
+        msg = decode(raw)
         request_id = msg.get("request_id", "unknown")
         msg_type = msg.get("type", "")
-        logger.info("[%s] Message reçu : type=%s depuis %s",
-                    request_id, msg_type, addr)
+        logger.debug("[%s] Message reçu : type=%s depuis %s",
+                     request_id, msg_type, addr)
+
+        version = msg.get("version")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Version de protocole non supportée : "
+                             f"{version!r}")
 
         if msg_type != "ingest_request":
+            logger.warning("[%s] Type non supporté : %s depuis %s",
+                           request_id, msg_type, addr)
             error_resp = build_message("error",
                 {"message": f"Type non supporté : {msg_type}"},
                 request_id=request_id)
-            conn.sendall(encode_message(error_resp))
-            return
+            return request_id, encode(error_resp), None
 
-        # Extraire et reconstruire la requête métier
+        # Valider les lectures directement depuis le payload
         payload = msg.get("payload", {})
-        ingest_req = IngestRequest.from_dict(payload)
-        logger.info("[%s] %d lectures à valider (source=%s)",
-                    request_id, len(ingest_req.readings), ingest_req.source)
-
-        # Valider les lectures
-        accepted, errors = validate_readings(ingest_req.readings)
-        elapsed_ms = (time.time() - start_time) * 1000
-
-        # Construire la réponse
-        response = IngestResponse(
-            request_id=request_id,
-            accepted_count=len(accepted),
-            rejected_count=len(errors),
-            errors=errors,
-            processing_time_ms=round(elapsed_ms, 2),
-        )
-
-        resp_msg = build_message("ingest_response",
-                                 response.to_dict(),
-                                 request_id=request_id)
-        conn.sendall(encode_message(resp_msg))
-
-        logger.info("[%s] Réponse envoyée : accepted=%d, rejected=%d, "
-                    "time=%.2fms",
-                    request_id, response.accepted_count,
-                    response.rejected_count, elapsed_ms)
-
-    except socket.timeout:
-        logger.error("[%s] Timeout client %s", request_id, addr)
+        response = process_ingest_payload(payload, request_id, start_time,
+                                          compact=version != "v1")
+        if binary:
+            encoded = encode(build_message("ingest_response", response,
+                                           request_id=request_id))
+        else:
+            encoded = encode_ingest_response(
+                request_id, response["accepted_count"],
+                response["rejected_count"], response["errors"],
+                response["processing_time_ms"])
+        summary = (payload.get("source", ""), response["accepted_count"],
+                   response["rejected_count"],
+                   response["processing_time_ms"])
+        return request_id, encoded, summary
+
     except (ValueError, KeyError) as e:
         logger.error("[%s] Erreur de parsing : %s", request_id, e)
+        err_msg = build_message("error",
+            {"message": str(e)}, request_id=request_id)
+        return request_id, encode(err_msg), None
+
+
+async def _ndjson_messages(reader: asyncio.StreamReader, prefix: bytes):
+    """Produit chaque ligne NDJSON reçue ; prefix : octets déjà lus."""
+    while True:
+        try:
+            line = await asyncio.wait_for(
+                reader.readuntil(b"\n"), CLIENT_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            # Connexion fermée : traiter un éventuel reste sans '\n'
+            if prefix or e.partial:
+                yield prefix + e.partial
+            return
+        yield prefix + line
+        prefix = b""
+
+
+async def _binary_frames(reader: asyncio.StreamReader, prefix: bytes):
+    """Produit le corps de chaque trame binaire ; prefix : octets déjà lus."""
+    while True:
+        try:
+            header = prefix + await asyncio.wait_for(
+                reader.readexactly(FRAME_HEADER.size - len(prefix)),
+                CLIENT_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            received = len(prefix) + len(e.partial)
+            if received:
+                raise ValueError(f"Trame tronquée ({received}/"
+                                 f"{FRAME_HEADER.size} octets)") from None
+            return
+        prefix = b""
+        (size,) = FRAME_HEADER.unpack(header)
+        if size > MAX_MESSAGE_SIZE:
+            raise asyncio.LimitOverrunError(
+                "Trame plus longue que la limite", FRAME_HEADER.size)
+        try:
+            yield await asyncio.wait_for(reader.readexactly(size),
+                                         CLIENT_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            raise ValueError(
+                f"Trame tronquée ({len(e.partial)}/{size} octets)") from None
+
+
+async def handle_client(reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter):
+    """
+    Traite une connexion client (un ou plusieurs messages). Le premier
+    octet choisit le format : trames MessagePack s'il vaut BINARY_MARKER,
+    NDJSON sinon.
+    """
+    addr = writer.get_extra_info("peername")
+    request_id = "unknown"
+    handled = 0
+    binary = False
+    loop = asyncio.get_running_loop()
+
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        tune_socket(sock)
+    logger.info("Connexion acceptée depuis %s:%d", addr[0], addr[1])
+
+    try:
+        first = await asyncio.wait_for(reader.read(1), CLIENT_TIMEOUT)
+        if first == BINARY_MARKER:
+            if not BINARY_AVAILABLE:
+                logger.error("Trames binaires reçues de %s mais msgpack "
+                             "n'est pas installé", addr)
+                return
+            binary = True
+            messages = _binary_frames(reader, first)
+        else:
+            messages = _ndjson_messages(reader, first)
+
+        async for raw in messages:
+            # Décodage et validation hors de la boucle d'événements
+            request_id, response, summary = await loop.run_in_executor(
+                None, process_message, raw, addr, binary)
+            writer.write(response)
+            await writer.drain()
+            handled += 1
+            # Un seul log par message, une fois la réponse envoyée
+            if summary is not None:
+                logger.info("[%s] Réponse envoyée (source=%s) : "
+                            "accepted=%d, rejected=%d, time=%.2fms, "
+                            "%d octets",
+                            request_id, *summary, len(response))
+
+        if not handled:
+            logger.warning("Connexion fermée immédiatement par %s", addr)
+
+    except asyncio.TimeoutError:
+        logger.error("[%s] Timeout client %s", request_id, addr)
+    except (asyncio.LimitOverrunError, ValueError) as e:
+        if isinstance(e, ValueError):
+            message = str(e)
+        else:
+            message = f"Message trop volumineux (> {MAX_MESSAGE_SIZE} octets)"
+        logger.error("[%s] Erreur de parsing : %s", request_id, message)
         try:
             err_msg = build_message("error",
-                {"message": str(e)}, request_id=request_id)
-            conn.sendall(encode_message(err_msg))
+                {"message": message}, request_id=request_id)
+            encode = encode_message_msgpack if binary else encode_message
+            writer.write(encode(err_msg))
+            await writer.drain()
         except OSError:
             pass
     except OSError as e:
         logger.error("[%s] Erreur réseau : %s", request_id, e)
     finally:
-        conn.close()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
 
 
-def run_server(host: str = "127.0.0.1", port: int = 9000):
-    """Lance le serveur TCP."""
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
+def create_listening_socket(host: str, port: int,
+                            reuse_port: bool = False) -> socket.socket:
+    """
+    Crée le socket d'écoute. Les buffers sont réglés avant listen() pour
+    que les connexions acceptées en héritent dès la poignée de main.
+    """
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
         srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        set_socket_buffers(srv)
         srv.bind((host, port))
-        srv.listen(5)
-        logger.info("🚀 Serveur en écoute sur %s:%d", host, port)
-
-        while True:
-            try:
-                conn, addr = srv.accept()
-                logger.info("Connexion acceptée depuis %s:%d",
-                            addr[0], addr[1])
-                handle_client(conn, addr)
-            except KeyboardInterrupt:
-                logger.info("Arrêt du serveur (Ctrl+C)")
-                break
-            except OSError as e:
-                logger.error("Erreur accept : %s", e)
+        srv.listen(LISTEN_BACKLOG)
+        srv.setblocking(False)
+    except OSError:
+        srv.close()
+        raise
+    return srv
+
+
+async def serve(host: str, port: int, threads: int = WORKER_THREADS,
+                reuse_port: bool = False):
+    """Démarre le serveur asyncio et sert les connexions indéfiniment."""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=threads, thread_name_prefix="ingestion"))
+    server = await asyncio.start_server(
+        handle_client, sock=create_listening_socket(host, port, reuse_port),
+        limit=MAX_MESSAGE_SIZE)
+    logger.info("🚀 Serveur en écoute sur %s:%d", host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def run_server(host: str = "127.0.0.1", port: int = 9000,
+               threads: int = WORKER_THREADS, processes: int = 1):
+    """
+    Lance le serveur TCP.
+    Avec processes > 1, plusieurs processus partagent le port via
+    SO_REUSEPORT et le noyau répartit les connexions entre eux.
+    """
+    reuse_port = processes > 1
+    if reuse_port and not hasattr(socket, "SO_REUSEPORT"):
+        raise ValueError("SO_REUSEPORT indisponible : un seul processus "
+                         "possible sur cette plateforme")
+
+    workers = [
+        multiprocessing.Process(target=_serve_forever,
+                                args=(host, port, threads, reuse_port),
+                                daemon=True)
+        for _ in range(processes - 1)
+    ]
+    for worker in workers:
+        worker.start()
+    _serve_forever(host, port, threads, reuse_port)
+    for worker in workers:
+        worker.terminate()
+
+
+def _serve_forever(host: str, port: int, threads: int, reuse_port: bool):
+    try:
+        asyncio.run(serve(host, port, threads, reuse_port))
+    except KeyboardInterrupt:
+        logger.info("Arrêt du serveur (Ctrl+C)")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Serveur d'ingestion IoT")
     parser.add_argument("--host", default="127.0.0.1")
     parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--threads", type=int, default=WORKER_THREADS,
+                        help="threads de traitement par processus")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="processus serveur partageant le port")
     args = parser.parse_args()
-    run_server(args.host, args.port)
\ No newline at end of file
+    run_server(args.host, args.port, args.threads, args.processes)
\ No newline at end of file
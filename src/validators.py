@@ -1,89 +1,129 @@
 """validators.py — Validation métier des lectures de capteurs."""
 import logging
 from datetime import datetime
+from functools import lru_cache
 from typing import List, Tuple
 
-from src.models import SensorReading, ValidationError
+from src.models import SENSOR_TYPES, SensorReading, ValidationError
 
 logger = logging.getLogger("ingestion.validator")
 
-# Plages de valeurs acceptables par type de capteur
-VALUE_RANGES = {
-    "temperature": (-50.0, 60.0),
-    "humidity": (0.0, 100.0),
-    "rainfall": (0.0, 500.0),
-    "irrigation": (0.0, 200.0),
-    "wind_speed": (0.0, 300.0),
-}
+# Plages de valeurs acceptables par type de capteur, dans l'ordre de
+# SENSOR_TYPES (strict=True : un type sans plage empêche l'import)
+VALUE_RANGES = dict(zip(SENSOR_TYPES, (
+    (-50.0, 60.0),    # temperature
+    (0.0, 100.0),     # humidity
+    (0.0, 500.0),     # rainfall
+    (0.0, 200.0),     # irrigation
+    (0.0, 300.0),     # wind_speed
+), strict=True))
 
 
-def validate_single_reading(reading: SensorReading) -> List[ValidationError]:
-    """Valide une lecture individuelle. Retourne la liste des erreurs."""
-    errors = []
-    sid = reading.sensor_id or "(vide)"
+# Nombre de timestamps distincts dont la validité est mémorisée
+TIMESTAMP_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def _timestamp_is_valid(timestamp: str) -> bool:
+    try:
+        datetime.fromisoformat(timestamp)
+    except ValueError:
+        return False
+    return True
+
+
+def is_valid_timestamp(timestamp: object) -> bool:
+    """
+    Indique si timestamp est une date ISO 8601 valide.
+    Le résultat est mémorisé : les capteurs d'un même lot partagent
+    généralement le même horodatage.
+    """
+    if not isinstance(timestamp, str):
+        return False
+    return _timestamp_is_valid(timestamp)
+
+
+# Types acceptés pour une valeur numérique (tuple construit une seule fois)
+_NUMERIC_TYPES = (int, float)
+
+
+def check_reading_fields(sensor_id, sensor_type, value, timestamp,
+                         pump_status=None, irrigation_mm=None,
+                         _ranges=VALUE_RANGES,
+                         _ts_ok=is_valid_timestamp) -> List[Tuple[str, str]]:
+    """
+    Contrôle les champs bruts d'une lecture.
+    Retourne la liste des (champ, message) en erreur, vide si valide.
+    """
+    problems = []
 
     # Vérifier sensor_id non vide
-    if not reading.sensor_id or not reading.sensor_id.strip():
-        errors.append(ValidationError(
-            sensor_id=sid, field="sensor_id",
-            message="Le sensor_id est obligatoire et ne peut être vide"))
-
-    # Vérifier que value est numérique
-    if not isinstance(reading.value, (int, float)):
-        errors.append(ValidationError(
-            sensor_id=sid, field="value",
-            message=f"Valeur non numérique : {reading.value!r} "
-                    f"(type={type(reading.value).__name__})"))
+    if not sensor_id or not sensor_id.strip():
+        problems.append((
+            "sensor_id", "Le sensor_id est obligatoire et ne peut être vide"))
+
+    # Vérifier que value est numérique (float/int exacts d'abord : cas
+    # courant ; isinstance ne sert qu'aux sous-classes, bool compris)
+    value_type = type(value)
+    if (value_type is not float and value_type is not int
+            and not isinstance(value, _NUMERIC_TYPES)):
+        problems.append((
+            "value", f"Valeur non numérique : {value!r} "
+                     f"(type={type(value).__name__})"))
     else:
         # Vérifier la plage de valeurs selon le type
-        range_tuple = VALUE_RANGES.get(reading.type)
-        if range_tuple:
+        range_tuple = _ranges.get(sensor_type)
+        if range_tuple is not None:
             vmin, vmax = range_tuple
-            if not (vmin <= reading.value <= vmax):
-                errors.append(ValidationError(
-                    sensor_id=sid, field="value",
-                    message=f"Valeur {reading.value} hors plage "
-                            f"[{vmin}, {vmax}] pour type={reading.type}"))
+            if not (vmin <= value <= vmax):
+                problems.append((
+                    "value", f"Valeur {value} hors plage "
+                             f"[{vmin}, {vmax}] pour type={sensor_type}"))
 
     # Vérifier le timestamp
-    try:
-        datetime.fromisoformat(reading.timestamp)
-    except (ValueError, TypeError):
-        errors.append(ValidationError(
-            sensor_id=sid, field="timestamp",
-            message=f"Timestamp invalide : {reading.timestamp!r}"))
+    if not _ts_ok(timestamp):
+        problems.append(("timestamp", f"Timestamp invalide : {timestamp!r}"))
 
     # Vérifier cohérence irrigation / pompe
-    if (reading.pump_status == "OFF"
-            and reading.irrigation_mm is not None
-            and reading.irrigation_mm > 0):
-        errors.append(ValidationError(
-            sensor_id=sid, field="pump_status",
-            message=f"pump_status=OFF mais irrigation_mm="
-                    f"{reading.irrigation_mm} > 0"))
+    if (irrigation_mm is not None and pump_status == "OFF"
+            and irrigation_mm > 0):
+        problems.append((
+            "pump_status", f"pump_status=OFF mais irrigation_mm="
+                           f"{irrigation_mm} > 0"))
 
-    return errors
+    return problems
+
+
+def validate_single_reading(reading: SensorReading) -> List[ValidationError]:
+    """Valide une lecture individuelle. Retourne la liste des erreurs."""
+    problems = check_reading_fields(
+        reading.sensor_id, reading.type, reading.value, reading.timestamp,
+        reading.pump_status, reading.irrigation_mm)
+    if not problems:
+        return []
+    sid = reading.sensor_id or "(vide)"
+    return [ValidationError(sensor_id=sid, field=name, message=message)
+            for name, message in problems]
 
 
 def validate_readings(
     readings: List[SensorReading],
+    _validate=validate_single_reading,
 ) -> Tuple[List[SensorReading], List[ValidationError]]:
     """
     Valide une liste de lectures.
-    Retourne (accepted, all_errors).
+    Retourne (accepted, all_errors). Un seul log de synthèse est émis
+    par lot, pas de log par lecture.
     """
     accepted = []
     all_errors = []
 
     for reading in readings:
-        errs = validate_single_reading(reading)
+        errs = _validate(reading)
         if errs:
             all_errors.extend(errs)
-            logger.warning("Lecture rejetée [%s] : %d erreur(s)",
-                           reading.sensor_id or "(vide)", len(errs))
         else:
             accepted.append(reading)
-            logger.debug("Lecture acceptée [%s]", reading.sensor_id)
 
     logger.info("Validation terminée : %d acceptées, %d erreur(s)",
                 len(accepted), len(all_errors))